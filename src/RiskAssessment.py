@@ -4,103 +4,326 @@ from gradio import themes
 import os
 from dotenv import find_dotenv, load_dotenv
 import requests
-import base64
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import gzip
+import hashlib
+import orjson
 from pathlib import Path
+import tempfile
 import time
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+import atexit
+from collections import OrderedDict
+from functools import lru_cache
+import threading
+import logging
+import logging.handlers
+import queue
+
+@lru_cache(maxsize=1)
+def _load_env():
+    """Locate and load the .env file once per process"""
+    # DOTENV_PATH skips the directory walk when the location is already known
+    dotenv_path = os.environ.get("DOTENV_PATH") or find_dotenv()
+    load_dotenv(dotenv_path)
+    return dotenv_path
 
 # Load environment variables from .env file
-load_dotenv(find_dotenv())
+_load_env()
 
-class FeatureState:
-    def __init__(self):
-        self.srs_content = None
-        self.project_summary = None
-        self.feature_details = None
-        self.approved_features = None  # New field to store approved features
+# Log through a queue so request threads never block on console output
+_log_queue = queue.SimpleQueue()
+log = logging.getLogger("risk_assessment")
+log.addHandler(logging.handlers.QueueHandler(_log_queue))
+log.propagate = False
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)
 
-# Create a global state object
-state = FeatureState()
+# Shared HTTP session so API calls reuse pooled keep-alive connections
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=["POST"]
+    )
+))
 
-def generate_summary_and_extract_features(pdf_path):
-    """Generate summary and extract features from PDF file using the API"""
-    try:
-        base_url = "https://risk-assessment-app.onrender.com"
-        
-        # Read the PDF file and encode it as base64
-        with open(pdf_path, 'rb') as file:
-            pdf_content = base64.b64encode(file.read()).decode('utf-8')
-
-        # First, generate summary
-        summary_endpoint = f"{base_url}/summary/generate"
-        summary_payload = {
-            "content": pdf_content,
-            "project_name": Path(pdf_path).stem
-        }
-        
-        summary_response = requests.post(
-            summary_endpoint, 
-            headers={'Content-Type': 'application/json'},
-            json=summary_payload
+# Request bodies at least this large are sent gzip-compressed
+_GZIP_MIN_BYTES = 1024
+# Cleared once the backend rejects compressed request bodies
+_gzip_accepted = True
+
+def _post_json(url, payload, headers=None, **kwargs):
+    """POST payload as a JSON body serialized with orjson.
+
+    Large bodies are gzip-compressed; if the backend answers 415 the request is
+    resent uncompressed and compression is not attempted again.
+    """
+    global _gzip_accepted
+    body = orjson.dumps(payload)
+    headers = {'Content-Type': 'application/json', **(headers or {})}
+    if _gzip_accepted and len(body) >= _GZIP_MIN_BYTES:
+        response = _session.post(
+            url,
+            data=gzip.compress(body, compresslevel=3),
+            headers={**headers, 'Content-Encoding': 'gzip'},
+            **kwargs
         )
-        summary_response.raise_for_status()
-        summary_result = summary_response.json()
-        
-        # Store the SRS content and project summary
-        state.srs_content = summary_result.get("srs_text", "")
-        state.project_summary = summary_result.get("project_summary", "")
-        
-        # Then, extract features using the summary
-        features_endpoint = f"{base_url}/features/extract"
-        features_payload = {
-            "srs_content": state.srs_content,
-            "project_summary": state.project_summary
+        if response.status_code != 415:
+            return response
+        response.close()
+        _gzip_accepted = False
+    return _session.post(url, data=body, headers=headers, **kwargs)
+
+# On-disk cache of API results, keyed by content hash
+_cache_dir = Path("./.ra_cache")
+
+# In-memory LRU in front of the disk cache, shared by the worker threads
+_CACHE_MAX_ENTRIES = 64
+_memory_cache = OrderedDict()
+_memory_cache_lock = threading.Lock()
+
+def _memory_cache_put(key, result):
+    with _memory_cache_lock:
+        _memory_cache[key] = result
+        _memory_cache.move_to_end(key)
+        if len(_memory_cache) > _CACHE_MAX_ENTRIES:
+            _memory_cache.popitem(last=False)
+
+def _cache_key(*parts):
+    """Build a stable cache key from the given strings or bytes"""
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else (part or "").encode('utf-8'))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+def _cache_load(key):
+    """Return the cached result for key, or None on a miss"""
+    with _memory_cache_lock:
+        if key in _memory_cache:
+            _memory_cache.move_to_end(key)
+            return _memory_cache[key]
+
+    cache_file = _cache_dir / f"{key}.json"
+    if not cache_file.exists():
+        return None
+    try:
+        result = orjson.loads(cache_file.read_bytes())
+    except (OSError, ValueError):
+        return None
+    _memory_cache_put(key, result)
+    return result
+
+def _cache_store(key, result):
+    """Atomically write result to the cache under key"""
+    _memory_cache_put(key, result)
+    tmp = None
+    try:
+        _cache_dir.mkdir(exist_ok=True)
+        # A unique temp file per writer so concurrent sessions never share one
+        fd, tmp = tempfile.mkstemp(dir=_cache_dir, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as file:
+            file.write(orjson.dumps(result))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp, _cache_dir / f"{key}.json")
+    except OSError as e:
+        log.warning("Cache write failed: %s", e)
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
+
+def _api_error(e):
+    """Format a failed API call, including the start of the response body"""
+    body = getattr(getattr(e, 'response', None), 'text', '')
+    return f"API Error: {e}" + (f"\nResponse: {body[:500]}" if body else "")
+
+# Cleared once the backend reports it has no combined pipeline route
+_pipeline_available = True
+
+def _extract_via_pipeline(base_url, files, data):
+    """Run summary and feature extraction server-side in a single request.
+
+    Returns None if the backend does not expose the pipeline endpoint.
+    """
+    global _pipeline_available
+    response = _session.post(f"{base_url}/pipeline/extract", files=files, data=data)
+    if response.status_code in (404, 405):
+        _pipeline_available = False
+        return None
+    response.raise_for_status()
+    result = orjson.loads(response.content)
+    return {
+        "srs_text": result.get("srs_text", ""),
+        "project_summary": result.get("project_summary", ""),
+        "feature_details": result.get("feature_details", "No features extracted")
+    }
+
+def _extract_in_two_steps(base_url, files, data):
+    """Generate the summary, then extract features from it, in two requests"""
+    summary_response = _session.post(f"{base_url}/summary/generate", files=files, data=data)
+    summary_response.raise_for_status()
+    summary_result = orjson.loads(summary_response.content)
+    srs_text = summary_result.get("srs_text", "")
+    project_summary = summary_result.get("project_summary", "")
+
+    features_response = _post_json(
+        f"{base_url}/features/extract",
+        {
+            "srs_content": srs_text,
+            "project_summary": project_summary
         }
+    )
+    features_response.raise_for_status()
+    return {
+        "srs_text": srs_text,
+        "project_summary": project_summary,
+        "feature_details": orjson.loads(features_response.content).get("feature_details", "No features extracted")
+    }
+
+def generate_summary_and_extract_features(pdf_bytes, filename):
+    """Generate summary and extract features from PDF content using the API.
+
+    Returns a (feature_details, srs_content, project_summary) tuple; on failure
+    the first item is the error message and the other two are None.
+    """
+    try:
+        base_url = "https://risk-assessment-app.onrender.com"
         
-        features_response = requests.post(
-            features_endpoint,
-            headers={'Content-Type': 'application/json'},
-            json=features_payload
-        )
-        features_response.raise_for_status()
-        
-        state.feature_details = features_response.json().get("feature_details", "No features extracted")
-        return state.feature_details
+        # The same bytes key the cache and form the upload
+        key = hashlib.blake2b(pdf_bytes, digest_size=16).hexdigest()
+
+        result = _cache_load(key)
+        if result is None:
+            # Upload the raw PDF as a multipart file
+            files = {'content': (filename, pdf_bytes, 'application/pdf')}
+            data = {'project_name': Path(filename).stem}
+
+            if _pipeline_available:
+                result = _extract_via_pipeline(base_url, files, data)
+            if result is None:
+                result = _extract_in_two_steps(base_url, files, data)
+            _cache_store(key, result)
+
+        return result["feature_details"], result["srs_text"], result["project_summary"]
 
     except requests.exceptions.RequestException as e:
-        print(f"API Error: {str(e)}")
-        if hasattr(e.response, 'text'):
-            print(f"Response text: {e.response.text}")
-        return f"API Error: {str(e)}"
+        error_message = _api_error(e)
+        log.warning("%s", error_message)
+        return error_message, None, None
     except Exception as e:
-        return f"Error: {str(e)}"
+        return f"Error: {str(e)}", None, None
+
+def _post_streaming(endpoint, payload, result_key, default, on_chunk=None):
+    """POST payload and return result_key from the response.
+
+    If the backend answers with a text/event-stream, the data of each event is
+    appended to the result and on_chunk is called with the text so far.
+    """
+    with _post_json(
+        endpoint,
+        payload,
+        headers={'Accept': 'text/event-stream, application/json'},
+        stream=True
+    ) as response:
+        if not response.ok:
+            # Load the error body now so it is still readable once the stream closes
+            response.content
+        response.raise_for_status()
+        if not response.headers.get('Content-Type', '').startswith('text/event-stream'):
+            return orjson.loads(response.content).get(result_key, default)
 
-def re_evaluate_features(previous_features, feedback):
+        # Server-sent events are always UTF-8
+        response.encoding = 'utf-8'
+        text = ""
+        event = []
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("data:"):
+                event.append(line[6:] if line.startswith("data: ") else line[5:])
+            elif not line and event:
+                text += "\n".join(event)
+                event = []
+                if on_chunk:
+                    on_chunk(text)
+        text += "\n".join(event)
+        return text or default
+
+def re_evaluate_features(previous_features, feedback, srs_content, project_summary, on_chunk=None):
     """Re-evaluate features based on feedback"""
     try:
         base_url = "https://risk-assessment-app.onrender.com"
         endpoint = f"{base_url}/features/re-evaluate"
+
+        key = _cache_key("re-evaluate", srs_content, project_summary, previous_features, feedback)
+        cached = _cache_load(key)
+        if cached is not None:
+            return cached["feature_details"]
         
         payload = {
-            "srs_content": state.srs_content,
-            "project_summary": state.project_summary,
+            "srs_content": srs_content,
+            "project_summary": project_summary,
             "previous_features": previous_features,
             "user_feedback": feedback
         }
         
-        response = requests.post(
-            endpoint,
-            headers={'Content-Type': 'application/json'},
-            json=payload
+        feature_details = _post_streaming(
+            endpoint, payload, "feature_details", "No features re-evaluated", on_chunk
         )
-        response.raise_for_status()
-        
-        state.feature_details = response.json().get("feature_details", "No features re-evaluated")
-        return state.feature_details
+        _cache_store(key, {"feature_details": feature_details})
+        return feature_details
+    except requests.exceptions.RequestException as e:
+        error_message = _api_error(e)
+        log.warning("%s", error_message)
+        return error_message
     except Exception as e:
         return f"Error in re-evaluation: {str(e)}"
 
+def analyze_risks(approved_features, srs_content, project_summary, on_chunk=None):
+    """Analyze risks of the approved features.
+
+    approved_features is the JSON-encoded string stored by approve_features.
+    """
+    base_url = "https://risk-assessment-app.onrender.com"
+    endpoint = f"{base_url}/api/risks/analyze"
+
+    key = _cache_key("risks", approved_features, srs_content, project_summary)
+    cached = _cache_load(key)
+    if cached is not None:
+        return cached["risk_analysis"]
+
+    payload = {
+        # Already JSON-encoded, so orjson copies it into the body as-is
+        "features": orjson.Fragment(approved_features),
+        "srs_content": srs_content,
+        "project_summary": project_summary
+    }
+
+    risk_analysis = _post_streaming(
+        endpoint, payload, "risk_analysis", "No risks identified", on_chunk
+    )
+    _cache_store(key, {"risk_analysis": risk_analysis})
+    return risk_analysis
+
+async def _partial_results(future, chunks):
+    """Yield the latest streamed partial result until the API call in future finishes"""
+    while not future.done():
+        getter = asyncio.ensure_future(chunks.get())
+        done, _ = await asyncio.wait({future, getter}, return_when=asyncio.FIRST_COMPLETED)
+        if getter not in done:
+            getter.cancel()
+            break
+        text = getter.result()
+        # Skip ahead to the newest chunk rather than re-rendering every one
+        while not chunks.empty():
+            text = chunks.get_nowait()
+        yield text
+
 async def process_documents_with_status(uploaded_file):
     """Process documents with status updates while waiting for API response"""
     if not uploaded_file:
@@ -108,48 +331,56 @@ async def process_documents_with_status(uploaded_file):
             "Please upload a requirements document first.",  # features output
             gr.update(visible=False),  # feedback section
             gr.update(visible=False),  # risk section
-            ""  # status message
+            "",  # status message
+            gr.update(),  # srs state (unchanged)
+            gr.update()  # summary state (unchanged)
         )
         return  # Exit the generator
 
-    # Start API call in a separate thread
-    with ThreadPoolExecutor() as executor:
-        future = executor.submit(generate_summary_and_extract_features, uploaded_file.name)
-        
-        # Show status messages while waiting for API response
-        messages = [
-            "Processing document...",
-            "Creating Knowledge graph...",
-            "Retrieving Nodes and Edges...",
-            "Thinking...",
-            "Generating Response..."
-        ]
-        
-        for message in messages:
-            if future.done():
-                break
-            yield (
-                "",  # features output (empty while processing)
-                gr.update(visible=False),  # feedback section
-                gr.update(visible=False),  # risk section
-                message  # status message
-            )
-            await asyncio.sleep(10)
-        
-        # Get API response
-        features = future.result()
-        
-        # Yield final results
+    # Read the file and call the API in worker threads to keep the event loop free
+    pdf_path = Path(uploaded_file.name)
+    try:
+        pdf_bytes = await asyncio.to_thread(pdf_path.read_bytes)
+    except OSError as e:
         yield (
-            features,
-            gr.update(visible=True),
-            gr.update(visible=True),
-            "Response Generated!"
+            f"Error: {str(e)}",
+            gr.update(visible=False),
+            gr.update(visible=False),
+            "Could not read the uploaded document",
+            gr.update(),
+            gr.update()
         )
+        return
+    future = asyncio.create_task(
+        asyncio.to_thread(generate_summary_and_extract_features, pdf_bytes, pdf_path.name)
+    )
+    
+    # Show a single status message while waiting for API response
+    yield (
+        "",  # features output (empty while processing)
+        gr.update(visible=False),  # feedback section
+        gr.update(visible=False),  # risk section
+        "Processing document...",  # status message
+        gr.update(),  # srs state (unchanged)
+        gr.update()  # summary state (unchanged)
+    )
+    
+    # Get API response
+    features, srs_content, project_summary = await future
+    
+    # Yield final results
+    yield (
+        features,
+        gr.update(visible=True),
+        gr.update(visible=True),
+        "Response Generated!",
+        srs_content,
+        project_summary
+    )
 
-async def handle_feedback_with_status(feedback, features):
+async def handle_feedback_with_status(feedback, features, srs_content, project_summary):
     """Handle feedback submission with status updates"""
-    if not feedback.strip():
+    if not feedback or not feedback.strip():
         yield (
             "Please provide feedback before submitting.",  # features output
             gr.update(visible=True),  # feedback section
@@ -158,113 +389,87 @@ async def handle_feedback_with_status(feedback, features):
         )
         return
 
-    # Start API call in a separate thread
-    with ThreadPoolExecutor() as executor:
-        future = executor.submit(re_evaluate_features, features, feedback)
-        
-        # Show status messages while waiting for API response
-        messages = [
-            "Processing feedback...",
-            "Analyzing feedback content...",
-            "Updating feature extraction...",
-            "Generating revised features..."
-        ]
-        
-        for message in messages:
-            if future.done():
-                break
-            yield (
-                "",  # features output (empty while processing)
-                gr.update(visible=True),  # feedback section
-                gr.update(visible=True),  # risk section
-                message  # status message
-            )
-            await asyncio.sleep(5)  # Shorter interval for feedback processing
-        
-        # Get API response
-        new_features = future.result()
-        
-        # Yield final results
+    # Start API call in a separate thread, streaming partial features back
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    future = asyncio.create_task(asyncio.to_thread(
+        re_evaluate_features, features, feedback, srs_content, project_summary,
+        lambda text: loop.call_soon_threadsafe(chunks.put_nowait, text)
+    ))
+
+    yield (
+        "",  # features output (empty until the first chunk arrives)
+        gr.update(visible=True),  # feedback section
+        gr.update(visible=True),  # risk section
+        "Processing feedback..."  # status message
+    )
+    async for partial in _partial_results(future, chunks):
         yield (
-            new_features,
+            partial,
             gr.update(visible=True),
             gr.update(visible=True),
-            "Feedback processed successfully!"
+            "Generating revised features..."
         )
+    
+    # Get API response
+    new_features = await future
+    
+    # Yield final results
+    yield (
+        new_features,
+        gr.update(visible=True),
+        gr.update(visible=True),
+        "Feedback processed successfully!"
+    )
 
 def approve_features(features):
     """Handle feature approval and store the features"""
-    state.approved_features = features
-    return "Features have been approved!", gr.update(visible=False), gr.update(visible=True)
+    # Encode once here rather than on every risk analysis request
+    approved_features = orjson.dumps(features) if features else None
+    return "Features have been approved!", gr.update(visible=False), gr.update(visible=True), approved_features
 
-async def analyze_risks_with_status(features):
+async def analyze_risks_with_status(approved_features, srs_content, project_summary):
     """Analyze risks with status updates while waiting for API response"""
-    try:
-        if not state.approved_features:
-            yield (
-                "Please approve features first before analyzing risks.",
-                "No approved features found"
-            )
-            return
-
-        base_url = "https://risk-assessment-app.onrender.com"
-        endpoint = f"{base_url}/api/risks/analyze"
-        
-        payload = {
-            "features": state.approved_features,
-            "srs_content": state.srs_content,
-            "project_summary": state.project_summary
-        }
+    if not approved_features:
+        yield (
+            "Please approve features first before analyzing risks.",
+            "No approved features found"
+        )
+        return
 
+    try:
         # Show initial status
         yield (
             "",
             "Initiating risk analysis..."
         )
 
-        with ThreadPoolExecutor() as executor:
-            future = executor.submit(
-                lambda: requests.post(
-                    endpoint,
-                    headers={'Content-Type': 'application/json'},
-                    json=payload
-                )
-            )
+        # Start API call in a separate thread, streaming the report back
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        future = asyncio.create_task(asyncio.to_thread(
+            analyze_risks, approved_features, srs_content, project_summary,
+            lambda text: loop.call_soon_threadsafe(chunks.put_nowait, text)
+        ))
 
-            # Status messages while waiting
-            messages = [
-                "Analyzing security risks...",
-                "Identifying vulnerabilities...",
-                "Evaluating compliance requirements...",
-                "Generating mitigation strategies...",
-                "Preparing final report..."
-            ]
-
-            for message in messages:
-                if future.done():
-                    break
-                yield (
-                    "",  # risk analysis output (empty while processing)
-                    message  # status message
-                )
-                await asyncio.sleep(5)
-
-            # Get API response
-            response = future.result()
-            response.raise_for_status()
-            
-            risk_analysis = response.json().get("risk_analysis", "No risks identified")
-            
-            # Yield final results
+        async for partial in _partial_results(future, chunks):
             yield (
-                risk_analysis,  # risk analysis output
-                "Risk analysis completed successfully!"  # status message
+                partial,  # risk analysis output so far
+                "Generating risk analysis..."  # status message
             )
 
+        # Get API response
+        risk_analysis = await future
+        
+        # Yield final results
+        yield (
+            risk_analysis,  # risk analysis output
+            "Risk analysis completed successfully!"  # status message
+        )
+
     except requests.exceptions.RequestException as e:
-        error_message = f"API Error: {str(e)}"
-        if hasattr(e.response, 'text'):
-            error_message += f"\nResponse: {e.response.text}"
+        error_message = _api_error(e)
+        log.warning("%s", error_message)
         yield (
             error_message,
             "Error occurred during risk analysis"
@@ -276,7 +481,14 @@ async def analyze_risks_with_status(features):
         )
 
 # Gradio UI
-with gr.Blocks(theme=gr.themes.Soft()) as demo:
+_THEME = themes.Soft()
+
+with gr.Blocks(theme=_THEME) as demo:
+    # Per-session document state, so concurrent users don't clobber each other
+    srs_state = gr.State()
+    summary_state = gr.State()
+    approved_state = gr.State()
+
     gr.Markdown(
         """
         ## Security Risk Assessment Using Multi-Agent RAG
@@ -336,13 +548,15 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
             features_output,
             feedback_section,
             risk_section,
-            status_box
+            status_box,
+            srs_state,
+            summary_state
         ]
     )
     
     submit_feedback_btn.click(
         fn=handle_feedback_with_status,
-        inputs=[feedback_input, features_output],
+        inputs=[feedback_input, features_output, srs_state, summary_state],
         outputs=[
             features_output,
             feedback_section,
@@ -354,12 +568,12 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
     approve_features_btn.click(
         approve_features,
         inputs=[features_output],
-        outputs=[status_box, feedback_section, risk_section]
+        outputs=[status_box, feedback_section, risk_section, approved_state]
     )
 
     analyze_risks_btn.click(
         fn=analyze_risks_with_status,
-        inputs=[features_output],
+        inputs=[approved_state, srs_state, summary_state],
         outputs=[
             risk_analysis_output,
             status_box
@@ -368,4 +582,5 @@ with gr.Blocks(theme=gr.themes.Soft()) as demo:
     )
 
 if __name__ == "__main__":
-    demo.launch()
+    # Bound concurrent runs and the waiting queue so overload fails fast
+    demo.queue(default_concurrency_limit=4, max_size=32, api_open=False).launch()